@@ -0,0 +1,39 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.backend.snapshot import catalog_snapshots
+from app.models.category import Category
+
+
+class CategoryTree:
+    """Per-worker copy of the (small) categories table.
+
+    Reloaded whenever the shared catalog version moves, so category writes made
+    by any worker are picked up on the next lookup.
+    """
+
+    def __init__(self):
+        self.version: int | None = None
+        self.ids_by_slug: dict[str, int] = {}
+        self.children: dict[int, list[int]] = {}
+
+    async def load(self, db: AsyncSession) -> None:
+        version = catalog_snapshots.version
+        rows = await db.execute(select(Category.id, Category.slug, Category.parent_id))
+        ids_by_slug, children = {}, {}
+        for category_id, slug, parent_id in rows:
+            ids_by_slug[slug] = category_id
+            if parent_id is not None:
+                children.setdefault(parent_id, []).append(category_id)
+        self.ids_by_slug, self.children, self.version = ids_by_slug, children, version
+
+    async def with_subcategories(self, db: AsyncSession, slug: str) -> list[int] | None:
+        if self.version != catalog_snapshots.version:
+            await self.load(db)
+        category_id = self.ids_by_slug.get(slug)
+        if category_id is None:
+            return None
+        return [category_id] + self.children.get(category_id, [])
+
+
+category_tree = CategoryTree()
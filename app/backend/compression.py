@@ -0,0 +1,159 @@
+import zlib
+
+import brotli
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Smaller bodies are not worth the CPU or the framing overhead
+MINIMUM_SIZE = 1024
+# Preference when the client accepts several with the same quality
+ENCODINGS = ('br', 'gzip')
+# Stored variants are compressed once per catalog version and can afford more effort
+STORED_LEVELS = {'br': 9, 'gzip': 9}
+STREAMING_LEVELS = {'br': 4, 'gzip': 6}
+# Larger bodies are compressed in the threadpool, not on the event loop
+THREADPOOL_SIZE = 64 * 1024
+# Streams that must reach the client message by message, or are not compressible
+SKIPPED_TYPES = ('text/event-stream', 'image/', 'video/', 'audio/', 'application/zip', 'application/gzip')
+# Responses that never carry a body
+BODYLESS_STATUSES = (204, 304)
+
+
+def negotiate(accept_encoding: str) -> str | None:
+    """Pick the best supported encoding from an Accept-Encoding header."""
+    best, best_quality = None, 0.0
+    for part in accept_encoding.lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip()
+        if coding not in ENCODINGS:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        if quality > best_quality or (quality == best_quality and best is not None
+                                      and ENCODINGS.index(coding) < ENCODINGS.index(best)):
+            best, best_quality = coding, quality
+    return best
+
+
+def compress(body: bytes, encoding: str, level: int | None = None) -> bytes:
+    level = STORED_LEVELS[encoding] if level is None else level
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+class _StreamCompressor:
+    def __init__(self, encoding: str):
+        level = STREAMING_LEVELS[encoding]
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=level)
+            self._zlib = None
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        # Flushed on every chunk so streamed progress reaches the client promptly
+        if self._brotli is not None:
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self._brotli is not None:
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+class CompressionMiddleware:
+    """Brotli/gzip response compression negotiated from Accept-Encoding.
+
+    Responses that already carry a Content-Encoding (pre-compressed snapshot
+    variants), event streams, HEAD requests and responses without a body pass
+    through untouched.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or scope['method'] == 'HEAD':
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Message | None = None
+        compressor: _StreamCompressor | None = None
+        passthrough = streaming = False
+        buffered: list[bytes] = []
+
+        def mark_encoded() -> None:
+            headers = MutableHeaders(raw=start['headers'])
+            headers['Content-Encoding'] = encoding
+            headers.add_vary_header('Accept-Encoding')
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, compressor, passthrough, streaming
+            if message['type'] == 'http.response.start':
+                headers = Headers(raw=message['headers'])
+                content_length = headers.get('content-length')
+                passthrough = (
+                    message['status'] in BODYLESS_STATUSES
+                    or 'content-encoding' in headers
+                    or headers.get('content-type', '').startswith(SKIPPED_TYPES)
+                    or (content_length is not None and int(content_length) < self.minimum_size)
+                )
+                if passthrough:
+                    await send(message)
+                    return
+                start = message
+                # Open-ended stream: compress chunk by chunk as it is produced
+                streaming = content_length is None
+                return
+            if passthrough or message['type'] != 'http.response.body':
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if streaming and compressor is None:
+                if not body and not more_body:
+                    # Turned out to have no body at all
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                mark_encoded()
+                compressor = _StreamCompressor(encoding)
+                await send(start)
+            if compressor is not None:
+                data = compressor.chunk(body)
+                if not more_body:
+                    data += compressor.finish()
+                await send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
+                return
+            # Known length: the body may still come in several messages, compress it whole
+            buffered.append(body)
+            if more_body:
+                return
+            body = b''.join(buffered)
+            if len(body) > THREADPOOL_SIZE:
+                data = await run_in_threadpool(compress, body, encoding, STREAMING_LEVELS[encoding])
+            else:
+                data = compress(body, encoding, STREAMING_LEVELS[encoding])
+            mark_encoded()
+            MutableHeaders(raw=start['headers'])['Content-Length'] = str(len(data))
+            await send(start)
+            await send({'type': 'http.response.body', 'body': data})
+
+        await self.app(scope, receive, send_compressed)
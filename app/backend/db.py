@@ -1,8 +1,14 @@
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import DeclarativeBase
 
+# Connections kept open per worker, all of them are opened and warmed up at startup
+POOL_SIZE = 5
+# No pre-ping round trip on checkout: connections are replaced after this many seconds
+# instead, and one found dead is invalidated by the error it raises
+POOL_RECYCLE = 1800
 
-engine = create_async_engine("postgresql+asyncpg://postgres_user:postgres_password@db:5432/postgres_database", echo=False)
+engine = create_async_engine("postgresql+asyncpg://postgres_user:postgres_password@db:5432/postgres_database",
+                             echo=False, pool_size=POOL_SIZE, max_overflow=10, pool_recycle=POOL_RECYCLE)
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
 
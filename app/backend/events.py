@@ -0,0 +1,115 @@
+import asyncio
+
+import asyncpg
+import orjson
+from loguru import logger
+from sqlalchemy import select, func, cast, Text
+
+from app.backend.db import engine
+from app.models import Product
+
+CATALOG_CHANNEL = 'catalog_changes'
+QUEUE_SIZE = 64
+RECONNECT_DELAY = 5.0
+
+
+def product_changes(*criteria):
+    """NOTIFY one stock/price/rating delta per product matching ``criteria``.
+
+    Execute it inside the writing transaction: PostgreSQL delivers the
+    notifications to every worker's listener only once the transaction commits.
+    """
+    payload = func.json_build_object(
+        'id', Product.id,
+        'category_id', Product.category_id,
+        'price', Product.price,
+        'stock', Product.stock,
+        'rating', Product.rating,
+        'is_active', Product.is_active,
+    )
+    return select(func.pg_notify(CATALOG_CHANNEL, cast(payload, Text))).where(*criteria)
+
+
+class ChangeHub:
+    """Fans catalog notifications out to the SSE subscribers of this worker.
+
+    One LISTEN connection per worker; subscribers are indexed by product and
+    category id, so an event only touches the queues interested in it and idle
+    connections cost nothing but their queue.
+    """
+
+    def __init__(self):
+        self._by_product: dict[int, set[asyncio.Queue]] = {}
+        self._by_category: dict[int, set[asyncio.Queue]] = {}
+        self._connection: asyncpg.Connection | None = None
+        self._reconnect: asyncio.Task | None = None
+        self._closing = False
+
+    def subscribe(self, product_ids: list[int], category_ids: list[int]) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        for product_id in product_ids:
+            self._by_product.setdefault(product_id, set()).add(queue)
+        for category_id in category_ids:
+            self._by_category.setdefault(category_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue, product_ids: list[int], category_ids: list[int]) -> None:
+        for index, keys in ((self._by_product, product_ids), (self._by_category, category_ids)):
+            for key in keys:
+                subscribers = index.get(key)
+                if subscribers is not None:
+                    subscribers.discard(queue)
+                    if not subscribers:
+                        del index[key]
+
+    def publish(self, payload: str) -> None:
+        change = orjson.loads(payload)
+        subscribers = self._by_product.get(change['id'], set()) | self._by_category.get(change['category_id'], set())
+        if not subscribers:
+            return
+        # Encoded once, the same bytes go to every subscriber
+        message = b'event: product\ndata: ' + payload.encode() + b'\n\n'
+        for queue in subscribers:
+            if queue.full():
+                # A slow client loses its oldest delta rather than holding memory
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    def _on_notify(self, connection, pid, channel, payload) -> None:
+        self.publish(payload)
+
+    def _on_terminate(self, connection) -> None:
+        self._connection = None
+        if not self._closing:
+            logger.bind(log_id='events').warning("Catalog listener connection lost, reconnecting")
+            self._reconnect = asyncio.get_running_loop().create_task(self._listen_forever())
+
+    async def _listen_forever(self) -> None:
+        while not self._closing:
+            try:
+                await self._connect()
+                return
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError):
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    def listen(self) -> None:
+        """Start listening in the background, retrying until the database is reachable."""
+        self._closing = False
+        self._reconnect = asyncio.get_running_loop().create_task(self._listen_forever())
+
+    async def _connect(self) -> None:
+        dsn = engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+        self._connection = await asyncpg.connect(dsn)
+        self._connection.add_termination_listener(self._on_terminate)
+        await self._connection.add_listener(CATALOG_CHANNEL, self._on_notify)
+
+    async def stop(self) -> None:
+        self._closing = True
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+
+change_hub = ChangeHub()
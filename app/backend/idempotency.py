@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+
+from fastapi import Request, status
+from sqlalchemy import select, update, delete, and_, or_
+from sqlalchemy.dialects.postgresql import insert
+from starlette.responses import JSONResponse, Response
+
+from app.backend.db import async_session_maker
+from app.models.idempotency import IdempotencyKey
+
+IDEMPOTENT_METHODS = ('POST', 'PUT', 'PATCH')
+KEY_TTL = timedelta(hours=24)
+# A claim older than this without a stored response belongs to a crashed request
+IN_FLIGHT_TIMEOUT = timedelta(seconds=60)
+WAIT_TIMEOUT = 30.0
+
+
+class IdempotencyStore:
+    """Key -> response store in the ``idempotency_keys`` table, shared by all workers.
+
+    The first request inserts the key and runs the handler; duplicates arriving
+    meanwhile wait for its response instead of running the handler again.
+    """
+
+    def __init__(self):
+        # Duplicates hitting the same worker wait on an event instead of polling
+        self._running: dict[str, asyncio.Event] = {}
+
+    async def claim(self, key: str, fingerprint: str) -> bool:
+        now = datetime.utcnow()
+        stmt = insert(IdempotencyKey).values(key=key, fingerprint=fingerprint, created_at=now)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[IdempotencyKey.key],
+            set_={'fingerprint': fingerprint, 'status_code': None, 'content_type': None, 'body': None,
+                  'created_at': now},
+            where=or_(IdempotencyKey.created_at < now - KEY_TTL,
+                      and_(IdempotencyKey.status_code.is_(None), IdempotencyKey.created_at < now - IN_FLIGHT_TIMEOUT))
+        ).returning(IdempotencyKey.key)
+        async with async_session_maker() as db:
+            claimed = await db.scalar(stmt)
+            await db.commit()
+        if claimed is not None:
+            self._running[key] = asyncio.Event()
+        return claimed is not None
+
+    async def fetch(self, key: str) -> IdempotencyKey | None:
+        async with async_session_maker() as db:
+            return await db.scalar(select(IdempotencyKey).where(IdempotencyKey.key == key))
+
+    async def wait(self, key: str) -> IdempotencyKey | None:
+        """Wait for the response of the request holding ``key``, None if the claim went away."""
+        deadline = asyncio.get_running_loop().time() + WAIT_TIMEOUT
+        delay = 0.05
+        while True:
+            event = self._running.get(key)
+            if event is not None:
+                await asyncio.wait_for(event.wait(), timeout=max(deadline - asyncio.get_running_loop().time(), 0))
+            stored = await self.fetch(key)
+            if stored is None or stored.status_code is not None:
+                return stored
+            if asyncio.get_running_loop().time() + delay > deadline:
+                raise asyncio.TimeoutError
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    async def complete(self, key: str, status_code: int, content_type: str | None, body: bytes) -> None:
+        async with async_session_maker() as db:
+            await db.execute(update(IdempotencyKey).where(IdempotencyKey.key == key).values(
+                status_code=status_code, content_type=content_type, body=body))
+            await db.commit()
+        self._finish(key)
+
+    async def release(self, key: str) -> None:
+        async with async_session_maker() as db:
+            await db.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key))
+            await db.commit()
+        self._finish(key)
+
+    def _finish(self, key: str) -> None:
+        event = self._running.pop(key, None)
+        if event is not None:
+            event.set()
+
+    async def delete_expired(self) -> None:
+        async with async_session_maker() as db:
+            await db.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < datetime.utcnow() - KEY_TTL))
+            await db.commit()
+
+
+idempotency_store = IdempotencyStore()
+
+
+async def idempotency_middleware(request: Request, call_next):
+    idempotency_key = request.headers.get('idempotency-key')
+    if request.method not in IDEMPOTENT_METHODS or not idempotency_key:
+        return await call_next(request)
+    if len(idempotency_key) > 255:
+        return JSONResponse({'detail': 'Idempotency-Key is too long'}, status_code=status.HTTP_400_BAD_REQUEST)
+
+    # Keys are scoped to the caller and the route, the payload must match on replay
+    key = hashlib.sha256('\n'.join((
+        request.headers.get('authorization', ''), request.method, request.url.path, idempotency_key
+    )).encode()).hexdigest()
+    fingerprint = hashlib.sha256(request.url.query.encode() + b'\n' + await request.body()).hexdigest()
+
+    while not await idempotency_store.claim(key, fingerprint):
+        try:
+            stored = await idempotency_store.wait(key)
+        except asyncio.TimeoutError:
+            return JSONResponse({'detail': 'A request with this Idempotency-Key is still in progress'},
+                                status_code=status.HTTP_409_CONFLICT)
+        if stored is None:
+            # The first request failed and gave the key up, try to take it over
+            continue
+        if stored.fingerprint != fingerprint:
+            return JSONResponse({'detail': 'Idempotency-Key was already used with a different request'},
+                                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return Response(stored.body, status_code=stored.status_code, media_type=stored.content_type,
+                        headers={'Idempotent-Replayed': 'true'})
+
+    try:
+        response = await call_next(request)
+        body = b''.join([chunk async for chunk in response.body_iterator])
+    except BaseException:
+        await idempotency_store.release(key)
+        raise
+    if response.status_code >= 500:
+        # Server errors are not final, let the client retry for real
+        await idempotency_store.release(key)
+    else:
+        await idempotency_store.complete(key, response.status_code, response.headers.get('content-type'), body)
+    return Response(body, status_code=response.status_code, headers=dict(response.headers))
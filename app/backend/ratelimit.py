@@ -0,0 +1,211 @@
+import fcntl
+import hashlib
+import ipaddress
+import math
+import mmap
+import os
+import struct
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+
+from fastapi import Request, status
+from jose import jwt, JWTError
+from loguru import logger
+from starlette.responses import JSONResponse
+
+from app.backend.snapshot import shared_directory
+from app.routers.auth import SECRET_KEY, ALGORITHM
+
+
+@dataclass(frozen=True)
+class Limit:
+    rate: int          # requests allowed per period
+    period: float      # seconds
+    burst: int = 1     # requests that may arrive back to back
+    key: str = 'ip'    # 'ip' or 'user' (falls back to ip for anonymous requests)
+
+    @property
+    def interval(self) -> float:
+        return self.period / self.rate
+
+    @property
+    def tolerance(self) -> float:
+        return self.interval * self.burst
+
+
+# (method, path prefix) -> limit, the longest matching prefix wins
+RATE_LIMITS: dict[tuple[str, str], Limit] = {
+    ('POST', '/auth/token'): Limit(rate=10, period=60, burst=5),
+    ('POST', '/auth/'): Limit(rate=5, period=60, burst=3),
+    ('POST', '/review/add_review'): Limit(rate=10, period=60, burst=3, key='user'),
+    ('GET', '/products'): Limit(rate=600, period=60, burst=100),
+    ('GET', '/category'): Limit(rate=600, period=60, burst=100),
+    ('GET', '/review'): Limit(rate=300, period=60, burst=50),
+}
+
+
+class MemoryBackend:
+    """GCRA state for a single worker: one theoretical arrival time per key."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._tat: OrderedDict[str, float] = OrderedDict()
+
+    def hit(self, key: str, limit: Limit, now: float) -> float:
+        """Return 0 if the request is allowed, otherwise seconds until it would be."""
+        tat = max(self._tat.get(key, now), now) + limit.interval
+        retry_after = tat - now - limit.tolerance
+        if retry_after > 0:
+            return retry_after
+        self._tat[key] = tat
+        # Least recently allowed key goes first, an expired one is as good as new anyway
+        self._tat.move_to_end(key)
+        if len(self._tat) > self.max_keys:
+            self._tat.popitem(last=False)
+        return 0.0
+
+    def close(self) -> None:
+        self._tat.clear()
+
+
+# Slot layout: 8-byte key hash + theoretical arrival time
+SLOT = struct.Struct('<Qd')
+
+
+class SharedMemoryBackend:
+    """GCRA state shared by all workers of a host through a memory-mapped table.
+
+    Stand-in for a Redis backend: keys hash into a fixed open-addressed table and
+    the chosen slot is guarded by a byte-range lock, so workers never block one
+    another on unrelated keys.
+    """
+
+    probes = 8
+
+    def __init__(self, path: str | None = None, slots: int = 65536):
+        self.path = path or os.path.join(shared_directory(), 'ratelimit')
+        self.slots = slots
+        self._fd: int | None = None
+        self._table: mmap.mmap | None = None
+
+    def _map(self) -> mmap.mmap:
+        if self._table is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            size = self.slots * SLOT.size
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._fd = fd
+            self._table = mmap.mmap(fd, size)
+        return self._table
+
+    def hit(self, key: str, limit: Limit, now: float) -> float:
+        table = self._map()
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+        offsets = [((digest + probe) % self.slots) * SLOT.size for probe in range(self.probes)]
+        # Unlocked scan only picks a slot, it is re-read under the lock below
+        chosen = None
+        for offset in offsets:
+            owner, tat = SLOT.unpack_from(table, offset)
+            if owner == digest:
+                chosen = offset
+                break
+            if chosen is None and (owner == 0 or tat <= now):
+                chosen = offset
+        if chosen is None:
+            chosen = offsets[-1]
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, SLOT.size, chosen)
+        try:
+            owner, tat = SLOT.unpack_from(table, chosen)
+            if owner != digest:
+                tat = now
+            tat = max(tat, now) + limit.interval
+            retry_after = tat - now - limit.tolerance
+            if retry_after > 0:
+                return retry_after
+            SLOT.pack_into(table, chosen, digest, tat)
+            return 0.0
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, SLOT.size, chosen)
+
+    def close(self) -> None:
+        if self._table is not None:
+            self._table.close()
+            os.close(self._fd)
+            self._table = self._fd = None
+
+
+class RateLimiter:
+    def __init__(self, backend, limits: dict[tuple[str, str], Limit], trusted_proxies=()):
+        self.backend = backend
+        self.limits = limits
+        self.trusted_proxies = tuple(ipaddress.ip_network(proxy) for proxy in trusted_proxies)
+        self.rejected: Counter[str] = Counter()
+        self._prefixes = sorted(limits, key=lambda rule: len(rule[1]), reverse=True)
+
+    def match(self, method: str, path: str) -> tuple[str, Limit] | None:
+        for rule_method, prefix in self._prefixes:
+            if rule_method == method and path.startswith(prefix):
+                return prefix, self.limits[(rule_method, prefix)]
+        return None
+
+    def _trusted(self, host: str) -> bool:
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted_proxies)
+
+    def client_key(self, request: Request, limit: Limit) -> str:
+        if limit.key == 'user':
+            authorization = request.headers.get('authorization', '')
+            if authorization.startswith('Bearer '):
+                try:
+                    user_id = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM]).get('id')
+                except JWTError:
+                    user_id = None
+                if user_id is not None:
+                    return f'user:{user_id}'
+        host = request.client.host if request.client else ''
+        # Only a trusted proxy's X-Forwarded-For counts, anyone else could rotate it at will.
+        # nginx appends the peer address last, earlier entries are client supplied
+        forwarded = request.headers.get('x-forwarded-for')
+        if forwarded and self._trusted(host):
+            return 'ip:' + forwarded.rsplit(',', 1)[-1].strip()
+        return 'ip:' + host
+
+    def check(self, request: Request) -> float:
+        matched = self.match(request.method, request.url.path)
+        if matched is None:
+            return 0.0
+        prefix, limit = matched
+        key = f'{request.method}:{prefix}:{self.client_key(request, limit)}'
+        retry_after = self.backend.hit(key, limit, time.time())
+        if retry_after > 0:
+            self.rejected[f'{request.method} {prefix}'] += 1
+        return retry_after
+
+
+def _backend():
+    if os.getenv('RATE_LIMIT_BACKEND', 'shared') == 'memory':
+        return MemoryBackend()
+    return SharedMemoryBackend()
+
+
+# Comma separated addresses or networks of the reverse proxies in front of the app
+TRUSTED_PROXIES = [proxy.strip() for proxy in os.getenv('TRUSTED_PROXIES', '').split(',') if proxy.strip()]
+
+rate_limiter = RateLimiter(_backend(), RATE_LIMITS, TRUSTED_PROXIES)
+
+
+async def rate_limit_middleware(request: Request, call_next):
+    retry_after = rate_limiter.check(request)
+    if retry_after > 0:
+        logger.warning(f"Request to {request.url.path} rate limited")
+        return JSONResponse(
+            {'detail': 'Too many requests'},
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={'Retry-After': str(math.ceil(retry_after))}
+        )
+    return await call_next(request)
@@ -0,0 +1,101 @@
+import secrets
+from collections import OrderedDict
+
+from slugify import slugify
+from sqlalchemy import select, exists, bindparam, union_all, case
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.backend.snapshot import catalog_snapshots
+
+
+class SlugCache:
+    """Per-worker LRU of slug -> id.
+
+    Emptied whenever the shared catalog version moves, so a slug renamed or
+    reused through any worker is never resolved to a stale id.
+    """
+
+    def __init__(self, maxsize: int = 10_000):
+        self.maxsize = maxsize
+        self.version: int | None = None
+        self._ids: OrderedDict[str, int] = OrderedDict()
+
+    def _check_version(self) -> None:
+        version = catalog_snapshots.version
+        if version != self.version:
+            self._ids.clear()
+            self.version = version
+
+    def get(self, slug: str) -> int | None:
+        self._check_version()
+        object_id = self._ids.get(slug)
+        if object_id is not None:
+            self._ids.move_to_end(slug)
+        return object_id
+
+    def put(self, slug: str, object_id: int, version: int) -> None:
+        """Cache ``object_id``, looked up while the catalog was at ``version``."""
+        self._check_version()
+        if version != self.version:
+            # A write landed during the lookup, the id may already be stale
+            return
+        self._ids[slug] = object_id
+        if len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+
+
+product_slugs = SlugCache()
+
+
+def _insert_with_slug(model, values: dict, slug: str, name: str, only_if_missing=None):
+    table = model.__table__
+    values = {**values, 'slug': slug}
+    # Filled in here: SQLAlchemy cannot render column defaults for two INSERTs in one query
+    for column in table.columns:
+        if column.key not in values and column.default is not None and column.default.is_scalar:
+            values[column.key] = column.default.arg
+    # Parameters named per statement, both INSERTs share one query
+    row = select(*[bindparam(f'{name}_{column}', value, type_=table.c[column].type)
+                   for column, value in values.items()])
+    if only_if_missing is not None:
+        row = row.where(~exists(select(only_if_missing.c.id)))
+    return insert(model).from_select(list(values), row, include_defaults=False).on_conflict_do_nothing(index_elements=['slug'])
+
+
+async def insert_with_unique_slug(db: AsyncSession, model, values: dict, name: str) -> tuple[int, str]:
+    """Insert a row slugged from ``name`` in one round trip, whatever slugs already exist.
+
+    The first CTE tries the plain slug; only when it hits a conflict does the
+    second one insert ``<slug>-<random suffix>`` instead. No uniqueness SELECT
+    beforehand and no IntegrityError on duplicates.
+    """
+    base = slugify(name)
+    while True:
+        plain = _insert_with_slug(model, values, base, 'plain').returning(model.id, model.slug).cte('plain')
+        suffixed = _insert_with_slug(
+            model, values, f'{base}-{secrets.token_hex(3)}', 'suffixed', only_if_missing=plain
+        ).returning(model.id, model.slug).cte('suffixed')
+        inserted = (await db.execute(union_all(
+            select(plain.c.id, plain.c.slug), select(suffixed.c.id, suffixed.c.slug)
+        ))).first()
+        # Both candidates taken: only possible if the random suffix collided too
+        if inserted is not None:
+            return inserted.id, inserted.slug
+
+
+def renamed_slug(model, name: str, object_id: int):
+    """SQL value for the slug of ``object_id`` renamed to ``name``, same suffix strategy as inserts.
+
+    A slug already derived from ``name`` is kept, so an update that does not
+    rename never changes the product's URL.
+    """
+    base = slugify(name)
+    other = aliased(model)
+    taken = exists(select(other.id).where(other.slug == base, other.id != object_id))
+    return case(
+        (model.slug.regexp_match(f'^{base}(-[0-9a-f]{{6}})?$'), model.slug),
+        (~taken, base),
+        else_=f'{base}-{secrets.token_hex(3)}',
+    )
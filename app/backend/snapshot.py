@@ -0,0 +1,147 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from collections import OrderedDict
+
+# Every blob starts with the catalog version it was built against
+HEADER = struct.Struct('<Q')
+# /dev/shm is 64MB in a default Docker container
+MAX_FILES = 512
+MAX_BYTES = 32 * 1024 * 1024
+
+
+def shared_directory() -> str:
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'fastapi_ecommerce')
+
+
+class SnapshotStore:
+    """Pre-encoded response bodies shared by all workers of a host.
+
+    Blobs live in memory-mapped files (tmpfs when available), so the 4 gunicorn
+    workers read the same pages instead of holding their own copies. A shared
+    version counter is bumped after every catalog write; blobs stamped with an
+    older version are treated as missing and rebuilt by the next reader.
+
+    Every put drops the least recently written blobs past ``max_files`` or
+    ``max_bytes``, and each worker keeps at most ``max_maps`` blobs mapped.
+    """
+
+    def __init__(self, directory: str | None = None, max_files: int = MAX_FILES, max_bytes: int = MAX_BYTES,
+                 max_maps: int = 256):
+        self.directory = directory or os.getenv('SNAPSHOT_DIR') or shared_directory()
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_maps = max_maps
+        self._version_fd: int | None = None
+        self._version_map: mmap.mmap | None = None
+        self._maps: OrderedDict[str, tuple[int, mmap.mmap]] = OrderedDict()
+
+    def _path(self, key: str) -> str:
+        # Keys may carry user supplied slugs, never use them as file names directly
+        return os.path.join(self.directory, hashlib.blake2b(key.encode(), digest_size=16).hexdigest() + '.snap')
+
+    def _counter(self) -> mmap.mmap:
+        if self._version_map is None:
+            os.makedirs(self.directory, exist_ok=True)
+            fd = os.open(os.path.join(self.directory, 'version'), os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(fd).st_size < HEADER.size:
+                os.ftruncate(fd, HEADER.size)
+            self._version_fd = fd
+            self._version_map = mmap.mmap(fd, HEADER.size)
+        return self._version_map
+
+    @property
+    def version(self) -> int:
+        return HEADER.unpack_from(self._counter(), 0)[0]
+
+    def invalidate(self) -> None:
+        counter = self._counter()
+        fcntl.flock(self._version_fd, fcntl.LOCK_EX)
+        try:
+            HEADER.pack_into(counter, 0, HEADER.unpack_from(counter, 0)[0] + 1)
+        finally:
+            fcntl.flock(self._version_fd, fcntl.LOCK_UN)
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            inode = os.stat(path).st_ino
+        except FileNotFoundError:
+            self._unmap(key)
+            return None
+        cached = self._maps.get(key)
+        if cached is None or cached[0] != inode:
+            self._unmap(key)
+            try:
+                with open(path, 'rb') as f:
+                    blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                return None
+            self._maps[key] = cached = (inode, blob)
+            if len(self._maps) > self.max_maps:
+                self._maps.popitem(last=False)[1][1].close()
+        else:
+            self._maps.move_to_end(key)
+        blob = cached[1]
+        if HEADER.unpack_from(blob, 0)[0] != self.version:
+            return None
+        return blob[HEADER.size:]
+
+    def put(self, key: str, payload: bytes, version: int) -> None:
+        """Store a blob built from data read *after* ``version`` was taken."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._prune(HEADER.size + len(payload))
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(version))
+                f.write(payload)
+            # Atomic swap: readers keep their old mapping until they notice the new inode
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _unmap(self, key: str) -> None:
+        cached = self._maps.pop(key, None)
+        if cached is not None:
+            cached[1].close()
+
+    def _prune(self, incoming: int) -> None:
+        """Make room for one more blob of ``incoming`` bytes, oldest blobs first."""
+        blobs = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.snap'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    blobs.append((stat.st_mtime, stat.st_size, entry.path))
+        blobs.sort()
+        count, size = len(blobs), sum(blob[1] for blob in blobs) + incoming
+        for _, blob_size, path in blobs:
+            if count < self.max_files and size <= self.max_bytes:
+                break
+            try:
+                # Workers holding it mapped keep reading the old pages until they notice
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            count, size = count - 1, size - blob_size
+
+    def close(self) -> None:
+        for _, blob in self._maps.values():
+            blob.close()
+        self._maps.clear()
+        if self._version_map is not None:
+            self._version_map.close()
+            os.close(self._version_fd)
+            self._version_map = self._version_fd = None
+
+
+catalog_snapshots = SnapshotStore()
@@ -0,0 +1,40 @@
+import asyncio
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.backend.category_tree import category_tree
+from app.backend.db import engine, async_session_maker
+from app.models import Category
+from app.models.user import User
+from app.routers.products import product_id_query, product_query
+
+# Seconds a worker waits for the warm-up before serving cold
+WARM_UP_TIMEOUT = 10.0
+
+# Same statements the routers issue: asyncpg caches prepared statements per
+# connection keyed by SQL text, so running them once with a dummy parameter
+# saves the PREPARE round trip on the first real request.
+WARM_STATEMENTS = (
+    product_id_query(''),
+    product_query(0),
+    select(Category).where(Category.id == 0),
+    select(User).where(User.username == ''),
+)
+
+
+async def _prepare(connection: AsyncConnection) -> None:
+    for statement in WARM_STATEMENTS:
+        await connection.execute(statement)
+
+
+async def warm_up(connections: int) -> None:
+    """Fill the pool with ready connections and preload the category tree."""
+    opened = await asyncio.gather(*(engine.connect() for _ in range(connections)))
+    try:
+        await asyncio.gather(*(_prepare(connection) for connection in opened))
+    finally:
+        # Closing returns the connections to the pool, where they stay open
+        await asyncio.gather(*(connection.close() for connection in opened))
+    async with async_session_maker() as db:
+        await category_tree.load(db)
@@ -0,0 +1,85 @@
+"""Move soft-deleted rows out of the hot tables.
+
+Rows inactive for more than ``--days`` days are moved into ``<table>_archive``
+in batches, each batch being a single DELETE ... RETURNING feeding an INSERT,
+so the hot tables and their indexes only hold live data.
+
+    python -m app.jobs.archive --days 30 --batch-size 1000
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+
+from loguru import logger
+from sqlalchemy import text
+
+from app.backend.db import Base, engine, async_session_maker
+from app.backend.idempotency import idempotency_store
+from app.backend.snapshot import catalog_snapshots
+from app.models import ratings, reviews
+
+# Children first, a row is only archived once nothing live references it
+ARCHIVE_RULES = {
+    'reviews': '',
+    'ratings': 'AND NOT EXISTS (SELECT 1 FROM reviews r WHERE r.rating_id = t.id)',
+    'products': 'AND NOT EXISTS (SELECT 1 FROM reviews r WHERE r.product_id = t.id) '
+                'AND NOT EXISTS (SELECT 1 FROM ratings r WHERE r.product_id = t.id)',
+    'categories': 'AND NOT EXISTS (SELECT 1 FROM products p WHERE p.category_id = t.id) '
+                  'AND NOT EXISTS (SELECT 1 FROM categories c WHERE c.parent_id = t.id)',
+}
+
+
+def archive_statement(table: str):
+    # Copied by name: archive columns are added at the end, not in the table's order
+    columns = ', '.join(Base.metadata.tables[table].columns.keys())
+    return text(f"""
+        WITH moved AS (
+            DELETE FROM {table} WHERE id IN (
+                SELECT t.id FROM {table} t
+                WHERE NOT t.is_active AND t.deactivated_at < :cutoff {ARCHIVE_RULES[table]}
+                LIMIT :batch_size
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING {columns}
+        )
+        INSERT INTO {table}_archive ({columns}, archived_at) SELECT {columns}, now() FROM moved
+    """)
+
+
+async def archive_table(table: str, cutoff: datetime, batch_size: int) -> int:
+    statement = archive_statement(table)
+    total = 0
+    while True:
+        async with async_session_maker() as db:
+            result = await db.execute(statement, {'cutoff': cutoff, 'batch_size': batch_size})
+            await db.commit()
+        total += result.rowcount
+        if result.rowcount < batch_size:
+            return total
+
+
+async def archive(days: int, batch_size: int) -> dict[str, int]:
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    moved = {}
+    for table in ARCHIVE_RULES:
+        moved[table] = await archive_table(table, cutoff, batch_size)
+        logger.info(f"Archived {moved[table]} rows from {table}")
+    if moved['categories']:
+        catalog_snapshots.invalidate()
+    await idempotency_store.delete_expired()
+    return moved
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=30, help='archive rows inactive for longer than this')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    try:
+        await archive(args.days, args.batch_size)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,270 @@
+"""Build the "customers also rated" neighbour lists from the ratings table.
+
+Item-to-item cosine similarity over the user x product grade matrix. It is
+computed with sparse matrix products, one block of products at a time, so
+memory stays bounded. The top K neighbours of every product are stored in
+``product_similarities``.
+
+A rating only changes the column of its product, so ``--incremental`` recomputes
+the rows of the changed products and patches their new scores into the stored
+lists of the other products. Only the top K of a list is stored: when a changed
+product's score drops, a neighbour just past the old cut-off may now belong in
+the list and is missing until the next full rebuild. Popular products share a
+user with most of the catalogue, so a batch touching them still patches most
+lists; the saving is in not recomputing them.
+
+    python -m app.jobs.similar_products                    # full rebuild
+    python -m app.jobs.similar_products --incremental      # recompute products with new or removed ratings, patch the rest
+    python -m app.jobs.similar_products --benchmark 5000000  # synthetic ratings, no database
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+import numpy as np
+from loguru import logger
+from scipy import sparse
+from sqlalchemy import select, delete, func, or_, bindparam, any_, Integer
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+
+from app.backend.db import engine, async_session_maker
+from app.models.ratings import Rating
+from app.models.similarity import ProductSimilarity
+
+TOP_K = 20
+BLOCK_SIZE = 2048
+WRITE_BATCH = 1000
+
+
+class RatingMatrix:
+    def __init__(self, user_ids: np.ndarray, product_ids: np.ndarray, grades: np.ndarray):
+        self.user_ids, users = np.unique(user_ids, return_inverse=True)
+        self.product_ids, items = np.unique(product_ids, return_inverse=True)
+        shape = (int(users.max()) + 1 if len(users) else 0, len(self.product_ids))
+        matrix = sparse.csr_matrix((grades.astype(np.float32), (users, items)), shape=shape)
+        # Duplicates are summed on construction: a user rating a product twice counts once, with the mean grade
+        counts = sparse.csr_matrix((np.ones(len(grades), np.float32), (users, items)), shape=shape)
+        matrix.data /= counts.data
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+        norms[norms == 0] = 1
+        # Unit-length product columns: a product of two columns is their cosine
+        self.by_user = (matrix @ sparse.diags(1 / norms)).tocsr()
+        self.by_product = self.by_user.T.tocsr()
+
+    def codes(self, product_ids: np.ndarray) -> np.ndarray:
+        # Products without any active rating have no column
+        product_ids = np.unique(product_ids)
+        return np.searchsorted(self.product_ids, product_ids[np.isin(product_ids, self.product_ids)])
+
+    def scores_with(self, codes: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Every nonzero (product, changed product, score) pair between ``codes`` and the other products."""
+        products, changed, scores = [], [], []
+        for start in range(0, len(codes), BLOCK_SIZE):
+            block_codes = codes[start:start + BLOCK_SIZE]
+            block = (self.by_product[block_codes] @ self.by_user).tocoo()
+            keep = ~np.isin(block.col, codes)
+            products.append(self.product_ids[block.col[keep]])
+            changed.append(self.product_ids[block_codes[block.row[keep]]])
+            scores.append(block.data[keep])
+        if not products:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+        return np.concatenate(products), np.concatenate(changed), np.concatenate(scores)
+
+    def top_neighbours(self, codes: np.ndarray, top_k: int):
+        for start in range(0, len(codes), BLOCK_SIZE):
+            block_codes = codes[start:start + BLOCK_SIZE]
+            block = self.by_product[block_codes] @ self.by_user
+            block.sort_indices()
+            for row, code in enumerate(block_codes):
+                begin, end = block.indptr[row], block.indptr[row + 1]
+                neighbours, scores = block.indices[begin:end], block.data[begin:end]
+                keep = neighbours != code
+                neighbours, scores = neighbours[keep], scores[keep]
+                if len(scores) > top_k:
+                    best = np.argpartition(-scores, top_k)[:top_k]
+                    neighbours, scores = neighbours[best], scores[best]
+                order = np.argsort(-scores, kind='stable')
+                yield int(self.product_ids[code]), self.product_ids[neighbours[order]], scores[order]
+
+
+async def load_ratings() -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # One row of four arrays: asyncpg decodes them far faster than millions of records
+    query = select(
+        func.array_agg(Rating.id), func.array_agg(Rating.user_id),
+        func.array_agg(Rating.product_id), func.array_agg(Rating.grade)
+    ).where(Rating.is_active == True, Rating.user_id.isnot(None), Rating.product_id.isnot(None))
+    async with async_session_maker() as db:
+        columns = (await db.execute(query)).one()
+    if columns[0] is None:
+        return tuple(np.empty(0, dtype=np.int64) for _ in range(4))
+    return tuple(np.asarray(column, dtype=np.int64) for column in columns)
+
+
+async def load_removed(since: datetime) -> np.ndarray:
+    """Product ids of the ratings deactivated since ``since``."""
+    query = select(func.array_agg(Rating.product_id)).where(
+        Rating.is_active == False, Rating.deactivated_at >= since, Rating.product_id.isnot(None))
+    async with async_session_maker() as db:
+        product_ids = await db.scalar(query)
+    return np.asarray(product_ids or [], dtype=np.int64)
+
+
+async def load_neighbours(product_ids: np.ndarray, changed_ids: np.ndarray) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+    """Stored lists of ``product_ids`` and of every product listing one of ``changed_ids``."""
+    changed = bindparam('changed_ids', changed_ids.tolist(), type_=ARRAY(Integer))
+    query = select(ProductSimilarity.product_id, ProductSimilarity.neighbour_ids, ProductSimilarity.scores).where(or_(
+        ProductSimilarity.product_id == any_(bindparam('product_ids', product_ids.tolist(), type_=ARRAY(Integer))),
+        ProductSimilarity.neighbour_ids.overlap(changed),
+    ))
+    async with async_session_maker() as db:
+        rows = await db.execute(query)
+        return {product_id: (np.asarray(neighbour_ids, dtype=np.int64), np.asarray(scores, dtype=np.float32))
+                for product_id, neighbour_ids, scores in rows}
+
+
+def patch_neighbours(stored: dict, changed_ids: np.ndarray, pairs, top_k: int):
+    """Replace the scores of ``changed_ids`` in the stored lists with the ones in ``pairs``."""
+    # The changed products themselves are recomputed, not patched
+    changed = set(changed_ids.tolist())
+    stored = {product_id: row for product_id, row in stored.items() if product_id not in changed}
+    product_ids = np.fromiter(stored, np.int64, len(stored))
+    owners = np.repeat(product_ids, [len(neighbour_ids) for neighbour_ids, _ in stored.values()])
+    neighbours = np.concatenate([neighbour_ids for neighbour_ids, _ in stored.values()] + [np.empty(0, np.int64)])
+    scores = np.concatenate([scores for _, scores in stored.values()] + [np.empty(0, np.float32)])
+    keep = ~np.isin(neighbours, changed_ids)
+    new = np.isin(pairs[0], product_ids)
+    owners = np.concatenate([owners[keep], pairs[0][new]])
+    neighbours = np.concatenate([neighbours[keep], pairs[1][new]])
+    scores = np.concatenate([scores[keep], pairs[2][new]])
+    # Best first within each owner, then the first top_k of every owner
+    order = np.lexsort((-scores, owners))
+    owners, neighbours, scores = owners[order], neighbours[order], scores[order]
+    keys, starts = np.unique(owners, return_index=True)
+    ranks = np.arange(len(owners)) - np.repeat(starts, np.diff(np.append(starts, len(owners))))
+    kept = ranks < top_k
+    owners, neighbours, scores = owners[kept], neighbours[kept], scores[kept]
+    bounds = np.searchsorted(owners, product_ids, side='left'), np.searchsorted(owners, product_ids, side='right')
+    for product_id, begin, end in zip(product_ids.tolist(), *bounds):
+        yield product_id, neighbours[begin:end], scores[begin:end]
+
+
+async def store(rows, watermark: int, built_at: datetime) -> int:
+    stmt = insert(ProductSimilarity)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ProductSimilarity.product_id],
+        set_={'neighbour_ids': stmt.excluded.neighbour_ids, 'scores': stmt.excluded.scores,
+              'rating_watermark': stmt.excluded.rating_watermark, 'built_at': stmt.excluded.built_at}
+    )
+    written = 0
+    batch = []
+    async with async_session_maker() as db:
+        for product_id, neighbour_ids, scores in rows:
+            batch.append({'product_id': product_id, 'neighbour_ids': neighbour_ids.tolist(),
+                          'scores': scores.tolist(), 'rating_watermark': watermark, 'built_at': built_at})
+            if len(batch) == WRITE_BATCH:
+                await db.execute(stmt, batch)
+                await db.commit()
+                written, batch = written + len(batch), []
+        if batch:
+            await db.execute(stmt, batch)
+            await db.commit()
+            written += len(batch)
+    return written
+
+
+async def build(incremental: bool, top_k: int) -> int:
+    started = time.perf_counter()
+    # Taken before the ratings are read, a rating removed during the build is caught by the next one
+    built_at = datetime.utcnow()
+    rating_ids, user_ids, product_ids, grades = await load_ratings()
+    if not len(rating_ids):
+        logger.info("No ratings, nothing to build")
+        return 0
+    watermark = int(rating_ids.max())
+    matrix = RatingMatrix(user_ids, product_ids, grades)
+    logger.info(f"Loaded {len(rating_ids)} ratings of {len(matrix.product_ids)} products "
+                f"in {time.perf_counter() - started:.1f}s")
+
+    if incremental:
+        async with async_session_maker() as db:
+            previous, previous_built_at = (await db.execute(select(
+                func.max(ProductSimilarity.rating_watermark), func.max(ProductSimilarity.built_at)))).one()
+        if previous is not None:
+            changed_ids = np.union1d(product_ids[rating_ids > previous], await load_removed(previous_built_at))
+            codes = matrix.codes(changed_ids)
+            pairs = matrix.scores_with(codes)
+            stored = await load_neighbours(np.unique(pairs[0]), changed_ids)
+            written = await store(matrix.top_neighbours(codes, top_k), watermark, built_at)
+            written += await store(patch_neighbours(stored, changed_ids, pairs, top_k), watermark, built_at)
+            unrated = np.setdiff1d(changed_ids, matrix.product_ids)
+            if len(unrated):
+                # Products left without any rating have no neighbours any more
+                async with async_session_maker() as db:
+                    await db.execute(delete(ProductSimilarity).where(
+                        ProductSimilarity.product_id.in_(unrated.tolist())))
+                    await db.commit()
+            logger.info(f"Recomputed {len(codes)} products and patched {len(stored)} lists "
+                        f"in {time.perf_counter() - started:.1f}s")
+            return written
+
+    written = await store(matrix.top_neighbours(np.arange(len(matrix.product_ids)), top_k), watermark, built_at)
+    # Every rated product was rewritten with this built_at, older rows lost all their ratings
+    async with async_session_maker() as db:
+        await db.execute(delete(ProductSimilarity).where(ProductSimilarity.built_at < built_at))
+        await db.commit()
+    logger.info(f"Stored neighbours of {written} products in {time.perf_counter() - started:.1f}s")
+    return written
+
+
+def benchmark(ratings: int, users: int, products: int, top_k: int) -> None:
+    rng = np.random.default_rng(0)
+    user_ids = rng.integers(0, users, ratings)
+    # Long-tailed popularity, like a real catalogue
+    product_ids = (rng.zipf(1.3, ratings) - 1) % products
+    grades = rng.integers(1, 6, ratings)
+
+    started = time.perf_counter()
+    matrix = RatingMatrix(user_ids, product_ids, grades)
+    built = time.perf_counter()
+    stored = {product_id: (neighbour_ids, scores) for product_id, neighbour_ids, scores
+              in matrix.top_neighbours(np.arange(len(matrix.product_ids)), top_k)}
+    count = len(stored)
+    finished = time.perf_counter()
+    print(f"{ratings} ratings, {users} users, {len(matrix.product_ids)} products rated")
+    print(f"matrix:     {built - started:8.2f}s")
+    print(f"neighbours: {finished - built:8.2f}s for {count} products (top {top_k})")
+
+    changed_ids = np.unique(product_ids[-ratings // 100:])
+    started = time.perf_counter()
+    codes = matrix.codes(changed_ids)
+    count = sum(1 for _ in matrix.top_neighbours(codes, top_k))
+    pairs = matrix.scores_with(codes)
+    listing = set(np.unique(pairs[0]).tolist())
+    listing.update(product_id for product_id, (neighbour_ids, _) in stored.items()
+                   if np.isin(neighbour_ids, changed_ids, assume_unique=True).any())
+    patched = sum(1 for _ in patch_neighbours({product_id: stored[product_id] for product_id in listing if product_id in stored},
+                                              changed_ids, pairs, top_k))
+    print(f"incremental: {time.perf_counter() - started:7.2f}s to recompute {count} products and patch "
+          f"{patched} lists after {ratings // 100} new ratings")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--incremental', action='store_true', help='only recompute products with new or removed ratings')
+    parser.add_argument('--top-k', type=int, default=TOP_K)
+    parser.add_argument('--benchmark', type=int, metavar='RATINGS', help='time a build on synthetic ratings')
+    parser.add_argument('--users', type=int, default=500_000, help='synthetic users for --benchmark')
+    parser.add_argument('--products', type=int, default=100_000, help='synthetic products for --benchmark')
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.benchmark, args.users, args.products, args.top_k)
+        return
+    try:
+        await build(args.incremental, args.top_k)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,13 +1,53 @@
+import asyncio
+import os
+import time
 import uuid
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
 from starlette.responses import JSONResponse
 
+from app.backend.compression import CompressionMiddleware
+from app.backend.db import engine, POOL_SIZE
+from app.backend.events import change_hub
+from app.backend.idempotency import idempotency_middleware, idempotency_store
+from app.backend.ratelimit import rate_limit_middleware, rate_limiter
+from app.backend.snapshot import catalog_snapshots
+from app.backend.warmup import warm_up, WARM_UP_TIMEOUT
 from app.routers import category, products, auth, permission, review
 from loguru import logger
 
-logger.add("info.log", format="Log: [{extra[log_id]}:{time} - {level} - {message} ", level="INFO", enqueue=True)
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    sink_id = logger.add("info.log", format="Log: [{extra[log_id]}:{time} - {level} - {message} ", level="INFO", enqueue=True)
+    startup_logger = logger.bind(log_id=f"startup-{os.getpid()}")
+    try:
+        # An unreachable database would otherwise hold startup for asyncpg's 60 s connect timeout
+        await asyncio.wait_for(warm_up(POOL_SIZE), WARM_UP_TIMEOUT)
+        await idempotency_store.delete_expired()
+    except Exception as e:
+        # Serve anyway, requests will open connections on demand
+        startup_logger.error(f"Warm-up failed: {e!r}")
+    change_hub.listen()
+    startup_logger.info(f"Worker started in {(time.perf_counter() - started) * 1000:.0f} ms")
+    yield
+    if rate_limiter.rejected:
+        startup_logger.info(f"Rate limited requests: {dict(rate_limiter.rejected)}")
+    await change_hub.stop()
+    await engine.dispose()
+    rate_limiter.backend.close()
+    catalog_snapshots.close()
+    await logger.complete()
+    logger.remove(sink_id)
+
+
+app = FastAPI(lifespan=lifespan)
+# Registered innermost first: log_middleware wraps the rate limiter, which runs
+# before idempotency keys are claimed
+app.middleware("http")(idempotency_middleware)
+app.middleware("http")(rate_limit_middleware)
 
 
 @app.middleware("http")
@@ -16,7 +56,7 @@ async def log_middleware(request: Request, call_next):
     with logger.contextualize(log_id=log_id):
         try:
             response = await call_next(request)
-            if response.status_code in [401, 402, 403, 404]:
+            if response.status_code in [401, 402, 403, 404, 429]:
                 logger.warning(f"Request to {request.url.path} failed")
             else:
                 logger.info(f"Request to {request.url.path} succeeded")
@@ -30,6 +70,9 @@ async def log_middleware(request: Request, call_next):
 async def welcome() -> dict:
     return {"message": "Me e-commerce app"}
 
+# Registered last so it is outermost: the other middlewares see uncompressed bodies
+app.add_middleware(CompressionMiddleware)
+
 app.include_router(category.router)
 app.include_router(products.router)
 app.include_router(auth.router)
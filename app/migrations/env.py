@@ -21,7 +21,7 @@ if config.config_file_name is not None:
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
 from app.backend.db import Base
-from app.models import category, products, ratings, reviews, user
+from app.models import category, products, ratings, reviews, user, idempotency, similarity
 target_metadata = Base.metadata
 
 # other values from the config, defined by the needs of env.py,
@@ -82,7 +82,12 @@ async def run_async_migrations() -> None:
 def run_migrations_online() -> None:
     """Run migrations in 'online' mode."""
 
-    asyncio.run(run_async_migrations())
+    # A caller running alembic programmatically may hand over its own connection
+    connection = config.attributes.get('connection')
+    if connection is None:
+        asyncio.run(run_async_migrations())
+    else:
+        do_run_migrations(connection)
 
 
 if context.is_offline_mode():
@@ -0,0 +1,35 @@
+"""product similarities
+
+Revision ID: 071d5418533f
+Revises: fca98402bcae
+Create Date: 2026-10-19 20:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '071d5418533f'
+down_revision: Union[str, None] = 'fca98402bcae'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('product_similarities',
+                    sa.Column('product_id', sa.Integer(), sa.ForeignKey('products.id', ondelete='CASCADE'),
+                              nullable=False),
+                    sa.Column('neighbour_ids', postgresql.ARRAY(sa.Integer()), nullable=False),
+                    sa.Column('scores', postgresql.ARRAY(sa.REAL()), nullable=False),
+                    sa.Column('rating_watermark', sa.Integer(), nullable=False),
+                    sa.Column('built_at', sa.TIMESTAMP(), nullable=False),
+                    sa.PrimaryKeyConstraint('product_id')
+                    )
+
+
+def downgrade() -> None:
+    op.drop_table('product_similarities')
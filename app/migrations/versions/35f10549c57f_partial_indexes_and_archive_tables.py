@@ -0,0 +1,58 @@
+"""partial indexes on active rows and archive tables
+
+Revision ID: 35f10549c57f
+Revises: e40cde7dfd3b
+Create Date: 2026-10-19 19:50:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '35f10549c57f'
+down_revision: Union[str, None] = 'e40cde7dfd3b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SOFT_DELETE_TABLES = ('products', 'categories', 'reviews', 'ratings')
+
+# name, table, columns, predicate
+PARTIAL_INDEXES = (
+    ('ix_products_active', 'products', ['id'], 'is_active AND stock > 0'),
+    ('ix_products_active_category_id', 'products', ['category_id'], 'is_active AND stock > 0'),
+    ('ix_categories_active_parent_id', 'categories', ['parent_id'], 'is_active'),
+    ('ix_reviews_active', 'reviews', ['id'], 'is_active'),
+    ('ix_reviews_active_product_id', 'reviews', ['product_id'], 'is_active'),
+    ('ix_ratings_active_product_id_grade', 'ratings', ['product_id', 'grade'], 'is_active'),
+)
+
+
+def upgrade() -> None:
+    # Soft deletes record when they happened, the archival job moves old ones out
+    for table in SOFT_DELETE_TABLES:
+        op.add_column(table, sa.Column('deactivated_at', sa.TIMESTAMP(), nullable=True))
+        # Rows deleted before this column existed start their retention period now
+        op.execute(f'UPDATE {table} SET deactivated_at = now() WHERE NOT is_active')
+        op.execute(f'CREATE TABLE {table}_archive (LIKE {table} INCLUDING DEFAULTS)')
+        op.add_column(f'{table}_archive', sa.Column('archived_at', sa.TIMESTAMP(), server_default=sa.func.now(),
+                                                    nullable=False))
+        op.create_index(f'ix_{table}_archive_id', f'{table}_archive', ['id'])
+
+    # Hot tables stay writable while the indexes are built
+    with op.get_context().autocommit_block():
+        for name, table, columns, predicate in PARTIAL_INDEXES:
+            op.create_index(name, table, columns, postgresql_where=sa.text(predicate),
+                            postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in PARTIAL_INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
+
+    for table in SOFT_DELETE_TABLES:
+        op.drop_table(f'{table}_archive')
+        op.drop_column(table, 'deactivated_at')
@@ -0,0 +1,45 @@
+"""indexes for the archival job
+
+Revision ID: bef8c42b4259
+Revises: 071d5418533f
+Create Date: 2026-10-20 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'bef8c42b4259'
+down_revision: Union[str, None] = '071d5418533f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SOFT_DELETE_TABLES = ('products', 'categories', 'reviews', 'ratings')
+
+# name, table, columns, predicate
+ARCHIVE_INDEXES = (
+    # The archival anti-joins look up inactive rows too, the is_active partial indexes do not cover them
+    ('ix_reviews_rating_id', 'reviews', ['rating_id'], None),
+    ('ix_reviews_product_id', 'reviews', ['product_id'], None),
+    ('ix_ratings_product_id', 'ratings', ['product_id'], None),
+    ('ix_products_category_id', 'products', ['category_id'], None),
+    ('ix_categories_parent_id', 'categories', ['parent_id'], None),
+    # Archival candidates
+    *((f'ix_{table}_deactivated_at', table, ['deactivated_at'], 'NOT is_active') for table in SOFT_DELETE_TABLES),
+)
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns, predicate in ARCHIVE_INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True,
+                            postgresql_where=sa.text(predicate) if predicate else None)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in ARCHIVE_INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,36 @@
+"""idempotency keys
+
+Revision ID: e40cde7dfd3b
+Revises: 73fcff857c1a
+Create Date: 2026-10-19 19:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e40cde7dfd3b'
+down_revision: Union[str, None] = '73fcff857c1a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('idempotency_keys',
+                    sa.Column('key', sa.String(), nullable=False),
+                    sa.Column('fingerprint', sa.String(), nullable=False),
+                    sa.Column('status_code', sa.Integer(), nullable=True),
+                    sa.Column('content_type', sa.String(), nullable=True),
+                    sa.Column('body', sa.LargeBinary(), nullable=True),
+                    sa.Column('created_at', sa.TIMESTAMP(), nullable=False),
+                    sa.PrimaryKeyConstraint('key')
+                    )
+    op.create_index('ix_idempotency_keys_created_at', 'idempotency_keys', ['created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_idempotency_keys_created_at', table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
@@ -0,0 +1,51 @@
+"""product review counts and ranking indexes
+
+Revision ID: fca98402bcae
+Revises: 35f10549c57f
+Create Date: 2026-10-19 20:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'fca98402bcae'
+down_revision: Union[str, None] = '35f10549c57f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# name, columns
+RANKING_INDEXES = (
+    ('ix_products_top_rated', ['rating DESC NULLS LAST', 'id']),
+    ('ix_products_top_rated_category', ['category_id', 'rating DESC NULLS LAST', 'id']),
+    ('ix_products_bestsellers', ['review_count DESC', 'id']),
+    ('ix_products_bestsellers_category', ['category_id', 'review_count DESC', 'id']),
+)
+
+
+def upgrade() -> None:
+    op.add_column('products', sa.Column('review_count', sa.Integer(), server_default='0', nullable=False))
+    # The archive mirrors the table, archive.py copies products rows into it
+    op.add_column('products_archive', sa.Column('review_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute("""
+        UPDATE products SET review_count = counts.total
+        FROM (SELECT product_id, count(*) AS total FROM reviews WHERE is_active GROUP BY product_id) AS counts
+        WHERE counts.product_id = products.id
+    """)
+
+    with op.get_context().autocommit_block():
+        for name, columns in RANKING_INDEXES:
+            op.create_index(name, 'products', [sa.text(column) for column in columns],
+                            postgresql_where=sa.text('is_active AND stock > 0'), postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, _ in RANKING_INDEXES:
+            op.drop_index(name, table_name='products', postgresql_concurrently=True)
+
+    op.drop_column('products_archive', 'review_count')
+    op.drop_column('products', 'review_count')
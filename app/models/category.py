@@ -1,16 +1,23 @@
 from app.backend.db import Base
-from sqlalchemy import Column, ForeignKey, String, Integer, Boolean
+from sqlalchemy import Column, ForeignKey, String, Integer, Boolean, TIMESTAMP, Index, text
 from sqlalchemy.orm import relationship, backref
 from app.models.products import Product
 
 
 class Category(Base):
     __tablename__ = 'categories'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        Index('ix_categories_active_parent_id', 'parent_id', postgresql_where=text('is_active')),
+        # Archival lookups
+        Index('ix_categories_parent_id', 'parent_id'),
+        Index('ix_categories_deactivated_at', 'deactivated_at', postgresql_where=text('NOT is_active')),
+        {'extend_existing': True},
+    )
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String)
     slug = Column(String, unique=True, index=True)
     is_active = Column(Boolean, default=True)
+    deactivated_at = Column(TIMESTAMP, nullable=True)
     parent_id = Column(Integer, ForeignKey('categories.id'), nullable=True)
 
     products = relationship("Product", back_populates="category")
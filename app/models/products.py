@@ -1,10 +1,26 @@
 from app.backend.db import Base
-from sqlalchemy import Column, ForeignKey, Integer, String, Boolean, Float
+from sqlalchemy import Column, ForeignKey, Integer, String, Boolean, Float, TIMESTAMP, Index, text
 from sqlalchemy.orm import relationship
 
 
 class Product(Base):
     __tablename__ = 'products'
+    __table_args__ = (
+        Index('ix_products_active', 'id', postgresql_where=text('is_active AND stock > 0')),
+        Index('ix_products_active_category_id', 'category_id', postgresql_where=text('is_active AND stock > 0')),
+        # Top-N rankings read the first rows of these instead of sorting the table
+        Index('ix_products_top_rated', text('rating DESC NULLS LAST'), 'id',
+              postgresql_where=text('is_active AND stock > 0')),
+        Index('ix_products_top_rated_category', 'category_id', text('rating DESC NULLS LAST'), 'id',
+              postgresql_where=text('is_active AND stock > 0')),
+        Index('ix_products_bestsellers', text('review_count DESC'), 'id',
+              postgresql_where=text('is_active AND stock > 0')),
+        Index('ix_products_bestsellers_category', 'category_id', text('review_count DESC'), 'id',
+              postgresql_where=text('is_active AND stock > 0')),
+        # Archival lookups
+        Index('ix_products_category_id', 'category_id'),
+        Index('ix_products_deactivated_at', 'deactivated_at', postgresql_where=text('NOT is_active')),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String)
@@ -14,7 +30,9 @@ class Product(Base):
     image_url = Column(String)
     stock = Column(Integer)
     rating = Column(Float)
+    review_count = Column(Integer, default=0, server_default='0', nullable=False)
     is_active = Column(Boolean, default=True)
+    deactivated_at = Column(TIMESTAMP, nullable=True)
     category_id = Column(Integer, ForeignKey('categories.id'))
     supplier_id = Column(Integer, ForeignKey('users.id'), nullable=True)
 
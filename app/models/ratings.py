@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, ForeignKey, Boolean, TIMESTAMP, Index, text
 from sqlalchemy.orm import relationship
 
 from app.backend.db import Base
@@ -6,12 +6,20 @@ from app.backend.db import Base
 
 class Rating(Base):
     __tablename__ = 'ratings'
+    # Covers the AVG(grade) recompute with an index-only scan
+    __table_args__ = (
+        Index('ix_ratings_active_product_id_grade', 'product_id', 'grade', postgresql_where=text('is_active')),
+        # Archival lookups
+        Index('ix_ratings_product_id', 'product_id'),
+        Index('ix_ratings_deactivated_at', 'deactivated_at', postgresql_where=text('NOT is_active')),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     grade = Column(Integer, nullable=False)
     user_id = Column(Integer, ForeignKey('users.id'))
     product_id = Column(Integer, ForeignKey('products.id'))
     is_active = Column(Boolean, default=True)
+    deactivated_at = Column(TIMESTAMP, nullable=True)
 
     product = relationship('Product', back_populates='ratings')
     user = relationship('User', back_populates='ratings')
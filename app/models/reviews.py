@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, ForeignKey, DATETIME, Boolean, TIMESTAMP
+from sqlalchemy import Column, Integer, String, ForeignKey, DATETIME, Boolean, TIMESTAMP, Index, text
 from sqlalchemy.orm import relationship
 
 from app.backend.db import Base
@@ -7,6 +7,14 @@ from app.backend.db import Base
 
 class Review(Base):
     __tablename__ = 'reviews'
+    __table_args__ = (
+        Index('ix_reviews_active', 'id', postgresql_where=text('is_active')),
+        Index('ix_reviews_active_product_id', 'product_id', postgresql_where=text('is_active')),
+        # Archival lookups
+        Index('ix_reviews_rating_id', 'rating_id'),
+        Index('ix_reviews_product_id', 'product_id'),
+        Index('ix_reviews_deactivated_at', 'deactivated_at', postgresql_where=text('NOT is_active')),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'))
@@ -15,6 +23,7 @@ class Review(Base):
     comment = Column(String)
     comment_date = Column(TIMESTAMP, default=datetime.utcnow)
     is_active = Column(Boolean, default=True)
+    deactivated_at = Column(TIMESTAMP, nullable=True)
 
     product = relationship('Product', back_populates='reviews')
     rating = relationship('Rating')
@@ -0,0 +1,17 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, ForeignKey, TIMESTAMP, REAL
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from app.backend.db import Base
+
+
+class ProductSimilarity(Base):
+    """Top-K "customers also rated" neighbours of a product, best first."""
+    __tablename__ = 'product_similarities'
+
+    product_id = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    neighbour_ids = Column(ARRAY(Integer), nullable=False)
+    scores = Column(ARRAY(REAL), nullable=False)
+    # Highest ratings.id the row was computed from, incremental builds start after it
+    rating_watermark = Column(Integer, nullable=False)
+    built_at = Column(TIMESTAMP, default=datetime.utcnow, nullable=False)
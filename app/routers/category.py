@@ -1,11 +1,14 @@
+from datetime import datetime
+
 from fastapi import APIRouter, HTTPException, status, Depends
 from sqlalchemy.orm import Session
 from typing import Annotated
-from sqlalchemy import insert, select, update
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from slugify import slugify
 
 from app.backend.db_depends import get_db
+from app.backend.slugs import insert_with_unique_slug, renamed_slug
+from app.backend.snapshot import catalog_snapshots
 from app.schemas import CreateCategory
 from app.models.category import Category
 from app.models.products import Product
@@ -27,10 +30,11 @@ async def create_category(db: Annotated[AsyncSession, Depends(get_db)],
                           get_user: Annotated[dict, Depends(get_current_user)]):
     if get_user.get('is_admin'):
 
-        await db.execute(insert(Category).values(name=create_category.name,
-                                           parent_id=create_category.parent_id,
-                                           slug=slugify(create_category.name)))
+        await insert_with_unique_slug(db, Category, {'name': create_category.name,
+                                                     'parent_id': create_category.parent_id},
+                                      create_category.name)
         await db.commit()
+        catalog_snapshots.invalidate()
         return {
             "status_code": status.HTTP_201_CREATED,
             "transaction": "Successful",
@@ -57,10 +61,11 @@ async def update_category(db: Annotated[AsyncSession, Depends(get_db)],
 
         await db.execute(update(Category).where(Category.id == category_id).values(
                 name=update_category.name,
-                slug=slugify(update_category.name),
+                slug=renamed_slug(Category, update_category.name, category_id),
                 parent_id=update_category.parent_id))
 
         await db.commit()
+        catalog_snapshots.invalidate()
         return {
             'status_code': status.HTTP_200_OK,
             'transaction': 'Category update is successful'
@@ -77,14 +82,17 @@ async def delete_category(db: Annotated[AsyncSession, Depends(get_db)],
                           category_id: int,
                           get_user: Annotated[dict, Depends(get_current_user)]):
     if get_user.get('is_admin'):
-        category = await db.scalars(select(Category).where(Category.id == category_id))
-        if category is None:
+        # Already deleted categories are left alone, a repeated delete must not restart their retention
+        deleted = await db.scalar(update(Category).where(Category.id == category_id, Category.is_active == True)
+                                  .values(is_active=False, deactivated_at=datetime.utcnow())
+                                  .returning(Category.id))
+        if deleted is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="There is no category found"
             )
-        await db.execute(update(Category).where(Category.id == category_id).values(is_active=False))
         await db.commit()
+        catalog_snapshots.invalidate()
         return {
             "status_code": status.HTTP_200_OK,
             "transaction": "Category delete is successful",
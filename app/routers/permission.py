@@ -1,10 +1,12 @@
 from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy import select, update
+from sqlalchemy import select, update, bindparam, any_, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.backend.db_depends import get_db
 from app.models.user import User
+from app.schemas import BulkUserIds
 from .auth import get_current_user
 
 router = APIRouter(prefix='/permission', tags=['permission'])
@@ -77,4 +79,76 @@ async def delete_user(db: Annotated[AsyncSession, Depends(get_db)], get_user: An
         )
 
 
+def bulk_user_update(user_ids: list[int], **values):
+    """One round trip: update every active non-admin user in ``user_ids`` and
+    report, per requested id, whether it existed and what became of it."""
+    ids = bindparam('user_ids', user_ids, type_=ARRAY(Integer))
+    target = select(User.id, User.is_active, User.is_admin).where(User.id == any_(ids)).cte('target')
+    updated = (
+        update(User)
+        .where(User.id == any_(ids), User.is_active == True, User.is_admin.isnot(True))
+        .values(**values)
+        .returning(User.id, User.is_supplier)
+        .cte('updated')
+    )
+    return select(
+        target.c.id, target.c.is_active, target.c.is_admin, updated.c.id.label('updated_id'), updated.c.is_supplier
+    ).select_from(target.outerjoin(updated, target.c.id == updated.c.id))
 
+
+@router.patch('/bulk')
+async def bulk_supplier_permission(
+        db: Annotated[AsyncSession, Depends(get_db)],
+        get_user: Annotated[dict, Depends(get_current_user)],
+        bulk: BulkUserIds
+):
+    if get_user.get('is_admin'):
+        rows = await db.execute(bulk_user_update(
+            bulk.user_ids, is_supplier=~User.is_supplier, is_customer=User.is_supplier))
+        await db.commit()
+        found = {}
+        for user_id, is_active, is_admin, updated_id, is_supplier in rows:
+            if updated_id is not None:
+                found[user_id] = 'User is now supplier' if is_supplier else 'User no longer supplier'
+            elif is_admin and is_active:
+                found[user_id] = 'Admin user skipped'
+        return {
+            'status_code': status.HTTP_200_OK,
+            'results': [{'user_id': user_id, 'detail': found.get(user_id, 'User not found')}
+                        for user_id in dict.fromkeys(bulk.user_ids)]
+        }
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='You do not have permission to perform this operation'
+        )
+
+
+# PATCH, not DELETE: a DELETE body is dropped by some clients and proxies
+@router.patch('/bulk_deactivate')
+async def bulk_deactivate_users(
+        db: Annotated[AsyncSession, Depends(get_db)],
+        get_user: Annotated[dict, Depends(get_current_user)],
+        bulk: BulkUserIds
+):
+    if get_user.get('is_admin'):
+        rows = await db.execute(bulk_user_update(bulk.user_ids, is_active=False))
+        await db.commit()
+        found = {}
+        for user_id, is_active, is_admin, updated_id, _ in rows:
+            if updated_id is not None:
+                found[user_id] = 'User deleted'
+            elif not is_active:
+                found[user_id] = 'User has already been deleted'
+            else:
+                found[user_id] = "You can't delete admin user"
+        return {
+            'status_code': status.HTTP_200_OK,
+            'results': [{'user_id': user_id, 'detail': found.get(user_id, 'User not found')}
+                        for user_id in dict.fromkeys(bulk.user_ids)]
+        }
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='You do not have admin permission'
+        )
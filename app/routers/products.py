@@ -1,24 +1,220 @@
-from fastapi import APIRouter, Depends, status, HTTPException
+from datetime import datetime
+
+import orjson
+import asyncio
+
+from fastapi import APIRouter, Depends, status, HTTPException, Response, Request, Query
+from fastapi.responses import StreamingResponse
+from loguru import logger
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated
-from sqlalchemy import insert, select, update
-from slugify import slugify
+from sqlalchemy import select, update, values, column, func, cast, bindparam, any_, literal_column, true, Integer, String
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by, array_agg
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
 
+from app.backend.category_tree import category_tree
+from app.backend.compression import ENCODINGS, MINIMUM_SIZE, compress, negotiate
+from app.backend.db import async_session_maker
 from app.backend.db_depends import get_db
+from app.backend.events import change_hub, product_changes
+from app.backend.slugs import insert_with_unique_slug, product_slugs, renamed_slug
+from app.backend.snapshot import catalog_snapshots
 from app.models import Category, Product
-from app.schemas import CreateProduct
+from app.models.ratings import Rating
+from app.models.reviews import Review
+from app.models.similarity import ProductSimilarity
+from app.schemas import CreateProduct, BulkProductUpdate, BulkProductRow
 from app.routers.auth import get_current_user
 
 router = APIRouter(prefix="/products", tags=["products"])
 
+# Rendered inline, not as a bind parameter: a generic plan for "stock > $1" cannot
+# use the partial indexes declared WHERE is_active AND stock > 0
+IN_STOCK = Product.stock > literal_column('0')
+BULK_CHUNK_SIZE = 1000
+STREAM_HEARTBEAT = 15.0
+STREAM_MAX_SUBSCRIPTIONS = 100
+# Orderings match the ix_products_top_rated* / ix_products_bestsellers* indexes
+RANKINGS = {
+    'top_rated': lambda product: (product.rating.desc().nulls_last(), product.id),
+    'bestsellers': lambda product: (product.review_count.desc(), product.id),
+}
+# Snapshot rebuilds in flight in this worker, by key
+_rebuilds: dict[str, asyncio.Future] = {}
+# Compression of stored variants, referenced until done so they are not garbage collected
+_variant_tasks: set[asyncio.Task] = set()
+
+
+def encode_products(products) -> bytes:
+    columns = Product.__table__.columns.keys()
+    return orjson.dumps([{column: getattr(product, column) for column in columns} for product in products])
+
+
+def snapshot_response(request: Request, key: str) -> Response | None:
+    encoding = negotiate(request.headers.get('accept-encoding', ''))
+    if encoding is not None:
+        compressed = catalog_snapshots.get(f'{key}:{encoding}')
+        if compressed is not None:
+            return Response(compressed, media_type='application/json',
+                            headers={'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'})
+    snapshot = catalog_snapshots.get(key)
+    if snapshot is not None:
+        return Response(snapshot, media_type='application/json')
+    return None
+
+
+def product_id_query(slug: str):
+    return select(Product.id).where(Product.slug == slug)
+
+
+def product_query(product_id: int):
+    return select(Product).where(Product.id == product_id)
+
+
+async def product_id_by_slug(db: AsyncSession, slug: str) -> int | None:
+    version = catalog_snapshots.version
+    product_id = product_slugs.get(slug)
+    if product_id is None:
+        product_id = await db.scalar(product_id_query(slug))
+        if product_id is not None:
+            product_slugs.put(slug, product_id, version)
+    return product_id
+
+
+def store_variants(key: str, body: bytes, version: int) -> None:
+    # Hot listings are compressed once per catalog version instead of on every request
+    for encoding in ENCODINGS:
+        try:
+            catalog_snapshots.put(f'{key}:{encoding}', compress(body, encoding), version)
+        except OSError as e:
+            logger.warning(f"Snapshot {key}:{encoding} not stored: {e}")
+            return
+
+
+async def rebuild_snapshot(key: str, load) -> bytes:
+    version = catalog_snapshots.version
+    # Own session: the rebuild outlives the request that started it if that client goes away
+    async with async_session_maker() as db:
+        products = await load(db)
+    # Encoding a large listing takes long enough to stall every other request on the loop
+    body = await run_in_threadpool(encode_products, products)
+    try:
+        await run_in_threadpool(catalog_snapshots.put, key, body, version)
+    except OSError as e:
+        # Out of space in the shared directory: still serve what was built
+        logger.warning(f"Snapshot {key} not stored: {e}")
+        return body
+    if len(body) >= MINIMUM_SIZE:
+        # Off the request path, until they land clients get the plain snapshot
+        task = asyncio.create_task(run_in_threadpool(store_variants, key, body, version))
+        _variant_tasks.add(task)
+        task.add_done_callback(_variant_tasks.discard)
+    return body
+
+
+async def snapshot_listing(request: Request, key: str, load) -> Response:
+    """Serve ``key`` from the snapshots, or rebuild it with ``load(db)``.
+
+    Requests missing the same key wait for one rebuild per worker instead of
+    each reading and encoding the listing again.
+    """
+    snapshot = snapshot_response(request, key)
+    if snapshot is not None:
+        return snapshot
+    rebuild = _rebuilds.get(key)
+    if rebuild is None:
+        rebuild = _rebuilds[key] = asyncio.ensure_future(rebuild_snapshot(key, load))
+        rebuild.add_done_callback(lambda _: _rebuilds.pop(key, None))
+    body = await asyncio.shield(rebuild)
+    return Response(body, media_type='application/json')
+
+
+def active_products_query():
+    return select(Product).where(Product.is_active == True, IN_STOCK)
+
 
 @router.get('/')
-async def all_products(db: Annotated[AsyncSession, Depends(get_db)]):
-    products = await db.scalars(select(Product).where(Product.is_active == True, Product.stock > 0))
-    if not products:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="There are no products")
-    return products.all()
+async def all_products(request: Request):
+    async def load(db: AsyncSession):
+        return (await db.scalars(active_products_query())).all()
+
+    return await snapshot_listing(request, 'all_products', load)
+
+
+async def stream_changes(queue: asyncio.Queue, product_ids: list[int], category_ids: list[int]):
+    try:
+        yield b'retry: 5000\n\n'
+        while True:
+            try:
+                yield await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                # Comment line, keeps proxies from closing an idle connection
+                yield b': keep-alive\n\n'
+    finally:
+        change_hub.unsubscribe(queue, product_ids, category_ids)
+
+
+@router.get('/stream')
+async def product_stream(product_ids: Annotated[list[int], Query()] = [],
+                         category_ids: Annotated[list[int], Query()] = []):
+    if not product_ids and not category_ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Subscribe to at least one product_ids or category_ids'
+        )
+    if len(product_ids) + len(category_ids) > STREAM_MAX_SUBSCRIPTIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'At most {STREAM_MAX_SUBSCRIPTIONS} subscriptions per stream'
+        )
+    queue = change_hub.subscribe(product_ids, category_ids)
+    return StreamingResponse(
+        stream_changes(queue, product_ids, category_ids),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def ranked_products_query(ranking: str, limit: int, categories: list[int] | None = None):
+    if categories is None:
+        return active_products_query().order_by(*RANKINGS[ranking](Product)).limit(limit)
+    # The first rows of every category in the subtree, then merged: sorting the whole
+    # subtree cannot read the per-category indexes in order
+    subtree = select(Category.id).where(Category.id.in_(categories)).subquery()
+    per_category = (active_products_query().where(Product.category_id == subtree.c.id)
+                    .order_by(*RANKINGS[ranking](Product)).limit(limit).lateral())
+    ranked = aliased(Product, per_category)
+    return (select(ranked).select_from(subtree).join(per_category, true())
+            .order_by(*RANKINGS[ranking](ranked)).limit(limit))
+
+
+async def ranked_products(request: Request, ranking: str, limit: int, category_slug: str | None):
+    async def load(db: AsyncSession):
+        categories = None
+        if category_slug is not None:
+            categories = await category_tree.with_subcategories(db, category_slug)
+            if not categories:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
+        return (await db.scalars(ranked_products_query(ranking, limit, categories))).all()
+
+    return await snapshot_listing(request, f'{ranking}:{category_slug or ""}:{limit}', load)
+
+
+@router.get('/top_rated')
+async def top_rated_products(request: Request,
+                             limit: Annotated[int, Query(ge=1, le=100)] = 10,
+                             category_slug: str | None = None):
+    return await ranked_products(request, 'top_rated', limit, category_slug)
+
+
+@router.get('/bestsellers')
+async def bestseller_products(request: Request,
+                              limit: Annotated[int, Query(ge=1, le=100)] = 10,
+                              category_slug: str | None = None):
+    return await ranked_products(request, 'bestsellers', limit, category_slug)
 
 
 @router.post('/create', status_code=status.HTTP_201_CREATED)
@@ -32,17 +228,17 @@ async def create_product(db: Annotated[AsyncSession, Depends(get_db)],
             detail="Category not found"
         )
     if get_user.get('is_admin') or get_user.get('is_supplier'):
-        await db.execute(insert(Product).values(
-            name=product.name,
-            slug=slugify(product.name),
-            description=product.description,
-            price=product.price,
-            image_url=product.image_url,
-            category_id=product.category,
-            stock=product.stock,
-            rating=0.0,
-            supplier_id=get_user.get('id')))
+        await insert_with_unique_slug(db, Product, {
+            'name': product.name,
+            'description': product.description,
+            'price': product.price,
+            'image_url': product.image_url,
+            'category_id': product.category,
+            'stock': product.stock,
+            'rating': 0.0,
+            'supplier_id': get_user.get('id')}, product.name)
         await db.commit()
+        catalog_snapshots.invalidate()
         return {
             "status_code": status.HTTP_201_CREATED,
             "transaction": "Successful"
@@ -54,31 +250,59 @@ async def create_product(db: Annotated[AsyncSession, Depends(get_db)],
         )
 
 
+def category_products_query(categories: list[int]):
+    return active_products_query().where(Product.category_id.in_(categories))
+
+
 @router.get('/{category_slug}')
-async def product_by_category(category_slug: str, db: Annotated[AsyncSession, Depends(get_db)]):
-    category = await db.scalar(select(Category).where(Category.slug == category_slug))
-    if not category:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
-    subcategories = await db.scalars(select(Category.id).where(Category.parent_id == category.id))
-    categories = [category.id] + [i.id for i in subcategories.all()]
-    products = await db.scalars(select(Product).where(
-        Product.category_id.in_(categories), Product.is_active == True, Product.stock > 0
-    ))
-    if not products:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="There are no products in this category")
+async def product_by_category(request: Request, category_slug: str):
+    async def load(db: AsyncSession):
+        categories = await category_tree.with_subcategories(db, category_slug)
+        if not categories:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
+        return (await db.scalars(category_products_query(categories))).all()
 
-    return products.all()
+    return await snapshot_listing(request, f'product_by_category:{category_slug}', load)
 
 
 @router.get('/detail/{product_slug}', status_code=status.HTTP_200_OK)
 async def product_detail(product_slug: str, db: Annotated[AsyncSession, Depends(get_db)]):
-    product = await db.execute(select(Product).where(Product.slug == product_slug))
-    if not product:
+    product_id = await product_id_by_slug(db, product_slug)
+    if product_id is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="There are no product found"
         )
-    return product.first()
+    product = await db.scalar(product_query(product_id))
+    if product is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="There are no product found"
+        )
+    return product
+
+
+@router.get('/{product_slug}/similar')
+async def similar_products(product_slug: str, db: Annotated[AsyncSession, Depends(get_db)]):
+    # Two primary key lookups, not worth a per-product snapshot file
+    product_id = await product_id_by_slug(db, product_slug)
+    if product_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="There are no product found"
+        )
+    neighbour_ids = await db.scalar(
+        select(ProductSimilarity.neighbour_ids).where(ProductSimilarity.product_id == product_id))
+    products = []
+    if neighbour_ids:
+        found = await db.scalars(select(Product).where(
+            Product.id == any_(bindparam('neighbour_ids', neighbour_ids, type_=ARRAY(Integer))),
+            Product.is_active == True, IN_STOCK
+        ))
+        # Keep the similarity order, best neighbour first
+        by_id = {product.id: product for product in found}
+        products = [by_id[neighbour_id] for neighbour_id in neighbour_ids if neighbour_id in by_id]
+    return Response(encode_products(products), media_type='application/json')
 
 
 @router.put('/detail/{product_slug}')
@@ -88,8 +312,8 @@ async def update_product(
         new_product: CreateProduct,
         get_user: Annotated[dict, Depends(get_current_user)]
 ):
-    product = await db.scalar(select(Product).where(Product.slug == product_slug))
-    if not product:
+    product_id = await product_id_by_slug(db, product_slug)
+    if product_id is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="There are no product found"
@@ -101,17 +325,32 @@ async def update_product(
             detail='There is no category found'
         )
     if get_user.get('is_supplier') or get_user.get('is_admin'):
-        if get_user.get('id') == new_product.supplier_id or get_user.get('is_admin'):
-            await db.execute(
-                update(Product).where(Product.slug == product_slug)
-                .values(name=new_product.name,
-                        description=new_product.description,
-                        price=new_product.price,
-                        image_url=new_product.image_url,
-                        stock=new_product.stock,
-                        category_id=new_product.category,
-                        slug=slugify(new_product.name)))
+        stmt = (
+            update(Product).where(Product.id == product_id)
+            .values(name=new_product.name,
+                    description=new_product.description,
+                    price=new_product.price,
+                    image_url=new_product.image_url,
+                    stock=new_product.stock,
+                    category_id=new_product.category,
+                    slug=renamed_slug(Product, new_product.name, product_id))
+            .returning(Product.id)
+        )
+        if not get_user.get('is_admin'):
+            # Ownership checked by the UPDATE itself, no row is loaded beforehand
+            stmt = stmt.where(Product.supplier_id == get_user.get('id'))
+        try:
+            updated = await db.scalar(stmt)
+        except IntegrityError:
+            # Only when a concurrent write took the chosen slug in the meantime
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail='The product slug was taken concurrently, retry the update'
+            )
+        if updated is not None:
+            await db.execute(product_changes(Product.id == product_id))
             await db.commit()
+            catalog_snapshots.invalidate()
             return {
                 'status_code': status.HTTP_200_OK,
                 'transaction': 'Product update is successful'
@@ -134,16 +373,27 @@ async def update_product(
 async def delete_product(product_slug: str,
                          db: Annotated[AsyncSession, Depends(get_db)],
                          get_user: Annotated[dict, Depends(get_current_user)]):
-    product_delete = await db.scalar(select(Product).where(Product.slug == product_slug))
-    if product_delete is None:
+    product_id = await product_id_by_slug(db, product_slug)
+    if product_id is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='There is no product found'
         )
     if get_user.get('is_supplier') or get_user.get('is_admin'):
-        if get_user.get('id') == product_delete.supplier_id or get_user.get('is_admin'):
-            await db.execute(update(Product).where(Product.slug == product_slug).values(is_active=False))
+        deactivated_at = datetime.utcnow()
+        # Already deleted products are left alone, a repeated delete must not restart their retention
+        stmt = update(Product).where(Product.id == product_id, Product.is_active == True).values(
+            is_active=False, deactivated_at=deactivated_at).returning(Product.id)
+        if not get_user.get('is_admin'):
+            stmt = stmt.where(Product.supplier_id == get_user.get('id'))
+        if await db.scalar(stmt) is not None:
+            # Reviews and ratings go with the product, otherwise it could never be archived
+            for model in (Review, Rating):
+                await db.execute(update(model).where(model.product_id == product_id, model.is_active == True)
+                                 .values(is_active=False, deactivated_at=deactivated_at))
+            await db.execute(product_changes(Product.id == product_id))
             await db.commit()
+            catalog_snapshots.invalidate()
             return {
                 'status_code': status.HTTP_200_OK,
                 'transaction': 'Product delete is successful'
@@ -158,3 +408,74 @@ async def delete_product(product_slug: str,
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail='You are not authorized to use this method'
         )
+
+
+def bulk_product_update(rows: list[BulkProductRow], supplier_id: int | None):
+    """A single UPDATE ... FROM (VALUES ...) for a chunk of partial price/stock rows."""
+    feed = values(
+        column('position', Integer), column('id', Integer), column('slug', String),
+        column('price', Integer), column('stock', Integer),
+        name='feed'
+    ).data([(position, row.id, row.slug, row.price, row.stock) for position, row in enumerate(rows)])
+    # NULLs are sent untyped, a column that is NULL in every row would come out as text
+    feed_id, feed_slug = cast(feed.c.id, Integer), cast(feed.c.slug, String)
+    by_slug = aliased(Product)
+    resolved = select(
+        func.coalesce(feed_id, select(by_slug.id).where(by_slug.slug == feed_slug).scalar_subquery())
+        .label('product_id'),
+        feed.c.position, cast(feed.c.price, Integer).label('price'), cast(feed.c.stock, Integer).label('stock'),
+    ).subquery('resolved')
+    # A product listed twice, by id or by slug, takes each field from the last row that sets it
+    latest = (
+        select(resolved.c.product_id, *(
+            array_agg(aggregate_order_by(field, resolved.c.position.desc())).filter(field.isnot(None))[1]
+            .label(field.name)
+            for field in (resolved.c.price, resolved.c.stock)
+        ))
+        .group_by(resolved.c.product_id)
+        .subquery('latest')
+    )
+    stmt = (
+        update(Product)
+        .where(Product.id == latest.c.product_id, Product.is_active == True)
+        .values(price=func.coalesce(latest.c.price, Product.price), stock=func.coalesce(latest.c.stock, Product.stock))
+        .returning(Product.id, Product.slug)
+    )
+    if supplier_id is not None:
+        stmt = stmt.where(Product.supplier_id == supplier_id)
+    return stmt
+
+
+async def bulk_update_progress(rows: list[BulkProductRow], supplier_id: int | None):
+    # The request session is closed before a streamed body is sent, use our own
+    async with async_session_maker() as db:
+        for start in range(0, len(rows), BULK_CHUNK_SIZE):
+            chunk = rows[start:start + BULK_CHUNK_SIZE]
+            updated = (await db.execute(bulk_product_update(chunk, supplier_id))).all()
+            if updated:
+                updated_ids = bindparam('updated_ids', [product_id for product_id, _ in updated], type_=ARRAY(Integer))
+                await db.execute(product_changes(Product.id == any_(updated_ids)))
+            await db.commit()
+            catalog_snapshots.invalidate()
+            updated_ids = {product_id for product_id, _ in updated}
+            updated_slugs = {slug for _, slug in updated}
+            skipped = [row.id if row.id is not None else row.slug for row in chunk
+                       if row.id not in updated_ids and row.slug not in updated_slugs]
+            yield orjson.dumps({
+                'processed': start + len(chunk),
+                'total': len(rows),
+                'updated': len(updated),
+                'skipped': skipped,
+            }) + b'\n'
+
+
+@router.patch('/bulk')
+async def bulk_update_products(bulk: BulkProductUpdate, get_user: Annotated[dict, Depends(get_current_user)]):
+    if not (get_user.get('is_supplier') or get_user.get('is_admin')):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='You are not authorized to use this method'
+        )
+    # Suppliers may only touch their own products, rows they do not own come back as skipped
+    supplier_id = None if get_user.get('is_admin') else get_user.get('id')
+    return StreamingResponse(bulk_update_progress(bulk.products, supplier_id), media_type='application/x-ndjson')
@@ -7,6 +7,8 @@ from sqlalchemy import select, update, insert, and_, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.backend.db_depends import get_db
+from app.backend.events import product_changes
+from app.backend.snapshot import catalog_snapshots
 from app.models import Product
 from app.models.ratings import Rating
 from app.models.reviews import Review
@@ -16,6 +18,18 @@ from app.schemas import ReviewInput
 router = APIRouter(prefix="/review", tags=["review"])
 
 
+def product_reviews_query(product_id: int):
+    return select(Review).where(Review.product_id == product_id, Review.is_active == True)
+
+
+def average_rating_query(product_id: int):
+    return select(func.avg(Rating.grade)).where(Rating.product_id == product_id, Rating.is_active == True)
+
+
+def review_count_query(product_id: int):
+    return select(func.count()).select_from(Review).where(Review.product_id == product_id, Review.is_active == True)
+
+
 @router.get("/all_reviews")
 async def get_all_reviews(db: Annotated[AsyncSession, Depends(get_db)]):
     reviews = await db.scalars(select(Review).where(Review.is_active == True))
@@ -31,7 +45,7 @@ async def get_products_reviews(
         db: Annotated[AsyncSession, Depends(get_db)],
         product_id: int
 ):
-    reviews = await db.scalars(select(Review).where(Review.id == product_id))
+    reviews = await db.scalars(product_reviews_query(product_id))
     if not reviews:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -83,13 +97,14 @@ async def add_review(
     await db.commit()
 
     # Пересчет рейтинга продукта
-    avg_rating = await db.scalar(select(func.avg(Rating.grade)).where(
-        Rating.product_id == review_data.product_id,
-        Rating.is_active == True
-    ))
+    avg_rating = await db.scalar(average_rating_query(review_data.product_id))
+    review_count = await db.scalar(review_count_query(review_data.product_id))
 
-    await db.execute(update(Product).where(Product.id == review_data.product_id).values(rating=avg_rating))
+    await db.execute(update(Product).where(Product.id == review_data.product_id).values(
+        rating=avg_rating, review_count=review_count))
+    await db.execute(product_changes(Product.id == review_data.product_id))
     await db.commit()
+    catalog_snapshots.invalidate()
 
     return {"status": status.HTTP_201_CREATED, "detail": "Review added"}
 
@@ -101,7 +116,7 @@ async def delete_reviews(
         get_user: Annotated[dict, Depends(get_current_user)],
 ):
     if get_user.get('is_admin'):
-        review: Review = await db.scalar(select(Review).where(Review.id == review_id))
+        review: Review = await db.scalar(select(Review).where(Review.id == review_id, Review.is_active == True))
         if not review:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -109,19 +124,24 @@ async def delete_reviews(
             )
 
         # Делаем неактивным отзыв и рейтинг
-        await db.execute(update(Review).where(Review.id == review_id).values(is_active=False))
-        await db.execute(update(Rating).where(Rating.id == review.rating_id).values(is_active=False))
+        deactivated_at = datetime.datetime.utcnow()
+        await db.execute(update(Review).where(Review.id == review_id).values(is_active=False,
+                                                                             deactivated_at=deactivated_at))
+        await db.execute(update(Rating).where(Rating.id == review.rating_id).values(is_active=False,
+                                                                                    deactivated_at=deactivated_at))
         await db.commit()
 
-        # Пересчитываем средний рейтинг для продукта
-        avg_rating = await db.scalar(select(func.avg(Rating.grade)).where(
-            Rating.product_id == review.product_id,
-            Rating.is_active == True
-        ))
+        # Пересчитываем средний рейтинг и число отзывов для продукта
+        avg_rating = await db.scalar(average_rating_query(review.product_id))
+        # Recounted rather than decremented: a concurrent or retried delete cannot make it drift
+        review_count = await db.scalar(review_count_query(review.product_id))
 
         # Обновляем рейтинг продукта
-        await db.execute(update(Product).where(Product.id == review.product_id).values(rating=avg_rating))
+        await db.execute(update(Product).where(Product.id == review.product_id).values(
+            rating=avg_rating, review_count=review_count))
+        await db.execute(product_changes(Product.id == review.product_id))
         await db.commit()
+        catalog_snapshots.invalidate()
 
         return {
             "status": status.HTTP_200_OK,
@@ -1,6 +1,6 @@
 import datetime
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
 
 class CreateProduct(BaseModel):
@@ -39,3 +39,23 @@ class ReviewInput(BaseModel):
     rating: int = Field(..., ge=1, le=5)
     product_id: int
 
+
+class BulkUserIds(BaseModel):
+    user_ids: list[int] = Field(..., min_length=1, max_length=10000)
+
+
+class BulkProductRow(BaseModel):
+    id: int | None = None
+    slug: str | None = None
+    price: int | None = Field(None, ge=0)
+    stock: int | None = Field(None, ge=0)
+
+    @model_validator(mode='after')
+    def check_key(self):
+        if (self.id is None) == (self.slug is None):
+            raise ValueError('Exactly one of id or slug is required')
+        return self
+
+
+class BulkProductUpdate(BaseModel):
+    products: list[BulkProductRow] = Field(..., min_length=1)